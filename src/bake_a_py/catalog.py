@@ -0,0 +1,125 @@
+"""Search the catalog of OS images.
+
+The catalog is the flattened os_list of the Raspberry Pi Imager. It is
+indexed once by name, device tag, architecture and release date, so that
+repeated queries do not scan all entries.
+"""
+
+import bisect
+import collections
+import difflib
+
+class Catalog:
+    """Indexed list of image descriptions.
+
+    :param entries: list of image descriptions (dictionaries)
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._by_name = {}
+        self._by_lower_name = {}
+        self._by_device = collections.defaultdict(set)
+        self._by_arch = collections.defaultdict(set)
+        self._by_date = []
+        self._by_size = []
+
+        for n, entry in enumerate(self.entries):
+            name = entry.get('name', '')
+            self._by_name.setdefault(name, n)
+            self._by_lower_name.setdefault(name.lower(), n)
+            for device in entry.get('devices', []):
+                self._by_device[device].add(n)
+            for arch in architectures(entry):
+                self._by_arch[arch].add(n)
+            if entry.get('release_date'):
+                self._by_date.append((entry['release_date'], n))
+            if entry.get('extract_size') is not None:
+                self._by_size.append((entry['extract_size'], n))
+        self._by_date.sort()
+        self._by_size.sort()
+
+    def get(self, name):
+        """Get the description of the image name.
+
+        :raise Exception: if there is no image with that name (the message
+            contains similar names)
+        """
+        n = self._by_name.get(name, self._by_lower_name.get(name.lower()))
+        if n is None:
+            similar = self.fuzzy(name)
+            hint = f' (did you mean {", ".join(similar)}?)' if similar else ''
+            raise Exception(f'no image {name}{hint}')
+        return self.entries[n]
+
+    def fuzzy(self, name, n=3, cutoff=0.6):
+        """Get the names most similar to name (ignoring case)."""
+        similar = difflib.get_close_matches(name.lower(),
+            list(self._by_lower_name), n, cutoff)
+        return [self.entries[self._by_lower_name[s]]['name'] for s in similar]
+
+    def search(self, name=None, fuzzy=False, device=None, arch=None,
+               since=None, until=None, min_size=None, max_size=None):
+        """Find the images matching all given criteria.
+
+        :param name: case insensitive substring of the name
+        :param fuzzy: match name by similarity as well
+        :param device: device tag (e.g. pi4-64bit)
+        :param arch: architecture (32bit or 64bit)
+        :param since: earliest release date (YYYY-MM-DD)
+        :param until: latest release date (YYYY-MM-DD)
+        :param min_size: minimal size of the extracted image in bytes
+        :param max_size: maximal size of the extracted image in bytes
+        :return: list of image descriptions in catalog order
+        """
+        candidates = None
+
+        def restrict(indices):
+            nonlocal candidates
+            candidates = set(indices) if candidates is None else candidates & set(indices)
+
+        if device is not None:
+            restrict(self._by_device.get(device, ()))
+        if arch is not None:
+            restrict(self._by_arch.get(arch, ()))
+        if since is not None or until is not None:
+            restrict(self._range(self._by_date, since, until))
+        if min_size is not None or max_size is not None:
+            restrict(self._range(self._by_size, min_size, max_size))
+        if name is not None:
+            matches = {n for lower, n in self._by_lower_name.items()
+                       if name.lower() in lower}
+            if fuzzy:
+                matches.update(self._by_name[s]
+                               for s in self.fuzzy(name, n=10, cutoff=0.4))
+            restrict(matches)
+
+        if candidates is None:
+            return list(self.entries)
+        return [self.entries[n] for n in sorted(candidates)]
+
+    def _range(self, index, lowest, highest):
+        lo = bisect.bisect_left(index, (lowest,)) if lowest is not None else 0
+        hi = bisect.bisect_right(index, (highest, len(self.entries))) \
+            if highest is not None else len(index)
+        return (n for _, n in index[lo:hi])
+
+def architectures(entry):
+    """Get the architectures of an image from its device tags and name."""
+    result = {device.rsplit('-', 1)[1] for device in entry.get('devices', [])
+              if device.endswith(('-32bit', '-64bit'))}
+    name = entry.get('name', '')
+    if '64-bit' in name:
+        result.add('64bit')
+    elif '32-bit' in name:
+        result.add('32bit')
+    return result
+
+def select(entry, fields):
+    """Select fields of an image description.
+
+    :param fields: list of field names (all fields if empty)
+    """
+    if not fields:
+        return entry
+    return {field: entry.get(field) for field in fields}
@@ -1,9 +1,15 @@
+import json
+import os
 import sys
 import traceback
 import click
 
+from . import catalog
 from . import imaging_utility as iu
 from . import provisioning
+from . import jobs
+from . import peers
+from . import tuning
 from . import __version__
 
 def eprint(msg, show):
@@ -55,9 +61,13 @@ def create(ctx, hidden):
     help='Keep the downloaded archive.')
 @click.option('--encrypted/--decrypted', ' /-d', default=True,
     help='Force usage of encrypted or decrypted provisioning configuration.')
+@click.option('--peer', '-p', multiple=True,
+    help='Base URL of a station sharing its image cache (e.g. http://station2:8787).')
+@click.option('--tune', is_flag=True,
+    help='Benchmark the device first if its model has not been benchmarked.')
 @click.pass_context
 def write(ctx, os, image_cache, output, chksum, target, become, remove, keep,
-          encrypted):
+          encrypted, peer, tune):
     """Write the image.
     
     OS is the image name (one of the results of the list command).
@@ -67,11 +77,157 @@ def write(ctx, os, image_cache, output, chksum, target, become, remove, keep,
     """
     try:
         iu.write(os, image_cache, output, target, chksum, become, remove, keep,
-                 encrypted)
+                 encrypted, peer, tune)
     except Exception as exc:
         eprint(f'Writing failed ({exc}).',
                ctx.obj['TRACEBACK'])
 
+@cli.command('bench-device')
+@click.argument('device')
+@click.option('--image-cache',
+    type=click.Path(file_okay=False), 
+    default='~/.cache/bake-a-py',
+    help='Path where the downloaded image is stored.')
+@click.option('--become', '-b', is_flag=True, 
+    help='Run the benchmark as super user.')
+@click.confirmation_option(
+    prompt='The start of the device will be overwritten. Continue?')
+@click.pass_context
+def bench_device(ctx, device, image_cache, become):
+    """Find the fastest write parameters for DEVICE.
+
+    The parameters are stored for the device model and used by later
+    writes.
+    """
+    try:
+        iu.udisks2.unmount(device)
+        for r in tuning.tune(device, image_cache, become):
+            click.echo(f'chunk size {r["chunk_size"] // 1024} KiB, '
+                       f'sync every {r["sync_every"]} chunks: '
+                       f'{r["throughput"] / 1024 / 1024:.1f} MiB/s')
+        click.echo(f'using {tuning.parameters(device)} '
+                   f'for {tuning.device_id(device)}')
+    except Exception as exc:
+        eprint(f'Benchmarking {device} failed ({exc}).',
+               ctx.obj['TRACEBACK'])
+
+@cli.command()
+@click.option('--image-cache',
+    type=click.Path(file_okay=False), 
+    default='~/.cache/bake-a-py',
+    help='Path where the downloaded image is stored.')
+@click.option('--port', type=int, default=peers.DEFAULT_PORT,
+    help='Port to listen on.')
+@click.option('--bind', default='',
+    help='Address to listen on (default all interfaces).')
+@click.pass_context
+def serve(ctx, image_cache, port, bind):
+    """Share the image cache with other stations.
+
+    Only archives kept with the --keep option of the write command are
+    served.
+    """
+    try:
+        peers.serve(image_cache, port, bind)
+    except KeyboardInterrupt:
+        pass
+    except Exception as exc:
+        eprint(f'Serving image cache failed ({exc}).',
+               ctx.obj['TRACEBACK'])
+
+@cli.command()
+@click.option('--image-cache',
+    type=click.Path(file_okay=False), 
+    default='~/.cache/bake-a-py',
+    help='Path where the downloaded image is stored.')
+@click.option('--socket', 'socket_path', default=jobs.DEFAULT_SOCKET,
+    help='Path of the socket to listen on.')
+@click.option('--become', '-b', is_flag=True, 
+    help='Run the writing of the image as super user.')
+@click.option('--network', type=int, default=jobs.DEFAULT_LIMITS['network'],
+    help='Number of concurrent downloads.')
+@click.option('--cpu', type=int, default=jobs.DEFAULT_LIMITS['cpu'],
+    help='Number of concurrent extractions and checks.')
+@click.option('--usb', type=int, default=jobs.DEFAULT_LIMITS['usb'],
+    help='Number of concurrent writes per USB host controller.')
+@click.option('--dbus', type=int, default=jobs.DEFAULT_LIMITS['dbus'],
+    help='Number of concurrent provisionings.')
+@click.pass_context
+def daemon(ctx, image_cache, socket_path, become, network, cpu, usb, dbus):
+    """Run the job daemon scheduling submitted jobs."""
+    try:
+        jobs.serve(image_cache, socket_path,
+                   dict(network=network, cpu=cpu, usb=usb, dbus=dbus), become)
+    except KeyboardInterrupt:
+        pass
+    except Exception as exc:
+        eprint(f'Running job daemon failed ({exc}).',
+               ctx.obj['TRACEBACK'])
+
+@cli.command()
+@click.argument('os_name', metavar='OS')
+@click.option('-o', '--output', required=True,
+    help='Device path to write the OS image to.')
+@click.option('--chksum/--no-chksum', '-c/ ', default=False,
+    help='Check the checksum of the OS image before writing.')
+@click.option('--target', '-t', 
+    help='Name of the configuration file.')
+@click.option('--keep', '-k', is_flag=True,
+    help='Keep the downloaded archive.')
+@click.option('--encrypted/--decrypted', ' /-d', default=True,
+    help='Force usage of encrypted or decrypted provisioning configuration.')
+@click.option('--peer', '-p', multiple=True,
+    help='Base URL of a station sharing its image cache (e.g. http://station2:8787).')
+@click.option('--socket', 'socket_path', default=jobs.DEFAULT_SOCKET,
+    help='Path of the socket of the job daemon.')
+@click.pass_context
+def submit(ctx, os_name, output, chksum, target, keep, encrypted, peer,
+           socket_path):
+    """Submit a write job to the job daemon.
+
+    OS is the image name (one of the results of the list command).
+    """
+    try:
+        if target:
+            target = os.path.abspath(target)
+        result = jobs.request('submit', socket_path, os=os_name,
+            output=output, target=target, chksum=chksum, keep=keep,
+            encrypted=encrypted, peers=peer)
+        click.echo(result['id'])
+    except Exception as exc:
+        eprint(f'Submitting job failed ({exc}).',
+               ctx.obj['TRACEBACK'])
+
+@cli.command()
+@click.argument('id', type=int, required=False)
+@click.option('--socket', 'socket_path', default=jobs.DEFAULT_SOCKET,
+    help='Path of the socket of the job daemon.')
+@click.pass_context
+def status(ctx, id, socket_path):
+    """Show the state of the job ID or of all jobs."""
+    try:
+        for job in jobs.request('status', socket_path, id=id):
+            stage = f' ({job["stage"]})' if job['stage'] else ''
+            error = f': {job["error"]}' if job['error'] else ''
+            click.echo(f'{job["id"]} {job["os"]} -> {job["output"]} '
+                       f'{job["state"]}{stage}{error}')
+    except Exception as exc:
+        eprint(f'Requesting job status failed ({exc}).',
+               ctx.obj['TRACEBACK'])
+
+@cli.command()
+@click.argument('id', type=int)
+@click.option('--socket', 'socket_path', default=jobs.DEFAULT_SOCKET,
+    help='Path of the socket of the job daemon.')
+@click.pass_context
+def cancel(ctx, id, socket_path):
+    """Cancel the job ID."""
+    try:
+        jobs.request('cancel', socket_path, id=id)
+    except Exception as exc:
+        eprint(f'Cancelling job {id} failed ({exc}).',
+               ctx.obj['TRACEBACK'])
+
 @cli.command()
 @click.argument('target')
 @click.option('-o', '--output',
@@ -112,18 +268,63 @@ def unmount(ctx, device):
         eprint(f'Unmounting {device} failed ({exc}).',
                ctx.obj['TRACEBACK'])
 
+@cli.command()
+@click.argument('os')
+@click.option('--image-cache',
+    type=click.Path(file_okay=False), 
+    default='~/.cache/bake-a-py',
+    help='Path where the downloaded image is stored.')
+@click.pass_context
+def inspect(ctx, os, image_cache):
+    """Show the partitions of the cached image OS.
+
+    A downloaded XZ archive is read without extracting it.
+    """
+    try:
+        for p in iu.get_partitions(os, image_cache):
+            click.echo(f'{p.number} type 0x{p.type:02x} start {p.start} '
+                       f'size {p.size} PARTUUID {p.partuuid} label {p.label}')
+    except Exception as exc:
+        eprint(f'Inspecting {os} failed ({exc}).',
+               ctx.obj['TRACEBACK'])
+
 @cli.command()
 @click.option('-a', '--all', is_flag=True, 
     help='All available images (not only Raspberry Pi OS images).')
+@click.option('--name', '-n',
+    help='Only images with names containing NAME (ignoring case).')
+@click.option('--fuzzy', is_flag=True,
+    help='Include images with names similar to NAME (requires --name).')
+@click.option('--device',
+    help='Only images for the device tag (e.g. pi4-64bit).')
+@click.option('--arch', type=click.Choice(['32bit', '64bit']),
+    help='Only images for the architecture.')
+@click.option('--since', help='Only images released on or after the date (YYYY-MM-DD).')
+@click.option('--until', help='Only images released on or before the date (YYYY-MM-DD).')
+@click.option('--min-size', type=int,
+    help='Only images with at least MIN_SIZE bytes extracted.')
+@click.option('--max-size', type=int,
+    help='Only images with at most MAX_SIZE bytes extracted.')
+@click.option('--json', 'as_json', is_flag=True,
+    help='Output the descriptions as JSON.')
+@click.option('--field', '-f', multiple=True,
+    help='Field of the description in the JSON output (repeatable).')
 @click.pass_context
-def list(ctx, all):
+def list(ctx, all, name, fuzzy, device, arch, since, until, min_size,
+         max_size, as_json, field):
     """List available OS images."""
+    if fuzzy and name is None:
+        raise click.UsageError('--fuzzy requires --name.')
     try:
-        if all:
-            result = iu.get_all_images()
+        if name is None and not all:
+            name = 'Raspberry Pi OS'
+        result = iu.get_catalog().search(name, fuzzy, device, arch, since,
+            until, min_size, max_size)
+        if as_json:
+            click.echo(json.dumps([catalog.select(i, field) for i in result],
+                                  indent=2))
         else:
-            result = iu.get_raspios_flavors()
-        click.echo('\n'.join(result))
+            click.echo('\n'.join(i['name'] for i in result))
     except Exception as exc:
         eprint(f'Listing OS images failed ({exc}).',
                ctx.obj['TRACEBACK'])
@@ -131,14 +332,20 @@ def list(ctx, all):
 @cli.command()
 @click.option('--verbose', '-v', is_flag=True,
     help='Show the complete description of the os image.')
+@click.option('--json', 'as_json', is_flag=True,
+    help='Output the description as JSON.')
+@click.option('--field', '-f', multiple=True,
+    help='Field of the description in the JSON output (repeatable).')
 @click.argument('name')
 @click.pass_context
-def describe(ctx, name, verbose):
+def describe(ctx, name, verbose, as_json, field):
     """Display the description of the OS image NAME.
     """
     try:
         desc = iu.get_image_description(name)
-        if verbose:
+        if as_json:
+            click.echo(json.dumps(catalog.select(desc, field), indent=2))
+        elif verbose:
             click.echo(desc)
         else:
             click.echo(desc['description'])
@@ -18,6 +18,7 @@ import pathlib
 import lzma
 from zipfile import ZipFile
 
+from . import journal
 from . import xz_helper
 from . import udisks2
 
@@ -25,16 +26,35 @@ def eprint(*args, **kwargs):
     """Print error messages to stderr."""
     print(*args, file=sys.stderr, **kwargs)
 
-def download(url, dest):
-    
-    response = requests.get(url, stream=True)
+def download(url, dest, sha256=None, timeout=None):
+    """Download url to dest.
+
+    :param url: URL of the file
+    :param dest: path of the destination file (only created if the download
+        is complete)
+    :param sha256: expected hex digest, verified while downloading
+    :param timeout: seconds to wait for connecting and for each read, or a
+        tuple (connect, read) as accepted by requests (no timeout if None)
+    """
+    dest = pathlib.Path(dest)
+    # An interrupted download must not be mistaken for a complete one.
+    part = dest.with_name(dest.name + '.part')
+
+    response = requests.get(url, stream=True, timeout=timeout)
+    response.raise_for_status()
+    hash = hashlib.sha256()
     with tqdm.wrapattr(
-        open(dest, "wb"), "write",
+        open(part, "wb"), "write",
         unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
         desc="Downloading", total=int(response.headers.get('content-length', 0))
         ) as fout:
         for chunk in response.iter_content(chunk_size=4096):
             fout.write(chunk)
+            hash.update(chunk)
+    if sha256 and hash.hexdigest() != sha256:
+        part.unlink(True)
+        raise Exception(f'download of {url} corrupted')
+    part.replace(dest)
 
 def sha256(fname):
     hash = hashlib.sha256()
@@ -84,30 +104,60 @@ def extract_zip(archive, dest, desc):
                     shutil.copyfileobj(CallbackIOWrapper(pbar.update, fi), fo)
 
 def extract_xz(archive, dest, desc):
-    _, uncompressed_size = xz_helper.xz_list(archive)
-    with lzma.open(archive) as fin:
-        write_with_progress(fin, dest, uncompressed_size, desc)
-
-def write_with_progress(fin, dest, size, desc="Writing"):
-    with tqdm.wrapattr(open(dest, 'wb'), 'write',
-            unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
-            desc=desc, total=size
-            ) as fout:
-        chunk = fin.read(1024*1024)
-        while chunk:
-            fout.write(chunk)
-            fout.flush()
-            os.fsync(fout.fileno())
-            chunk = fin.read(1024*1024)
+    """Extract a XZ file resuming an interrupted extraction.
+
+    Files with a block index are decompressed block by block, so that a
+    resumed extraction starts at the block containing the last verified
+    chunk. Other files are decompressed from the start, but only the
+    missing part is written.
+    """
+    try:
+        header, blocks = xz_helper.xz_blocks(archive)
+        uncompressed_size = sum(b.uncompressed_size for b in blocks)
+    except Exception:
+        blocks = None
+        _, uncompressed_size = xz_helper.xz_list(archive)
+
+    jrnl = journal.Journal(journal.path_for(dest), journal.identify(archive))
+    offset = jrnl.resume(dest)
+    try:
+        with open(archive, 'rb') as f, tqdm.wrapattr(
+                open(dest, 'r+b' if offset else 'wb'), 'write',
+                unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
+                desc=desc, total=uncompressed_size, initial=offset
+                ) as fout:
+            fout.seek(offset)
+            if blocks:
+                for block in blocks:
+                    if block.uncompressed_offset + block.uncompressed_size <= offset:
+                        continue
+                    with xz_helper.open_block(f, header, block) as fin:
+                        _skip(fin, offset - block.uncompressed_offset)
+                        offset = journal.write_chunks(fin, fout, jrnl, offset,
+                                                      block=block.index)
+            else:
+                with lzma.open(f) as fin:
+                    fin.seek(offset)
+                    journal.write_chunks(fin, fout, jrnl, offset)
+    finally:
+        jrnl.close()
+    jrnl.complete()
+
+def _skip(fin, size):
+    while size:
+        chunk = fin.read(min(size, journal.CHUNK_SIZE))
+        if not chunk:
+            raise Exception('unexpected end of compressed data')
+        size -= len(chunk)
 
-def write_customisation(device, mountpoint, firstrun_script):
+def write_customisation(device, mountpoint, firstrun_script, snapshot=None):
     with open(mountpoint.joinpath('firstrun.sh'), 'w') as fout:
         print(firstrun_script, file=fout)
     with open(mountpoint.joinpath('cmdline.txt'), 'w') as fout:
-        partuuid = udisks2.get_partuuid(device, 'rootfs')
+        partuuid = udisks2.get_partuuid(device, 'rootfs', snapshot)
         print(f'console=serial0,115200 console=tty1 root=PARTUUID={partuuid} rootfstype=ext4 elevator=deadline fsck.repair=yes rootwait quiet init=/usr/lib/raspi-config/init_resize.sh systemd.run=/boot/firstrun.sh systemd.run_success_action=reboot systemd.unit=kernel-command-line.target', file=fout)
 
-def customize_rpios(conf_fname, device, encrypted=True):
+def customize_rpios(conf_fname, device, encrypted=True, snapshot=None):
     if encrypted:
         result = subprocess.run(['gpg', '-d', '-o', '-', conf_fname],
                                 capture_output=True)
@@ -128,8 +178,10 @@ def customize_rpios(conf_fname, device, encrypted=True):
     env = jinja2.Environment(loader=loader).get_template('firstrun.sh.j2')
     firstrun_script = env.render(d)
 
-    boot = pathlib.Path(udisks2.find_boot(device))
+    snapshot = snapshot or udisks2.Snapshot(device)
+    boot = udisks2.find_boot(device, snapshot)
     if boot:
-        write_customisation(device, boot, firstrun_script)
+        write_customisation(device, pathlib.Path(boot), firstrun_script,
+                            snapshot)
     else:
         raise Exception(f'no partition mounted as boot on {device}')
@@ -4,11 +4,19 @@ import pathlib
 import urllib.request
 import time
 
+from . import catalog
 from . import helper
+from . import journal
+from . import mbr
+from . import peers as peer_cache
 from . import udisks2
 from . import sudo
+from . import tuning
+from . import xz_helper
 
 _IMAGINGUTILITY_URL = 'https://downloads.raspberrypi.org/os_list_imagingutility_v3.json'
+_CATALOG_CACHE = '~/.cache/bake-a-py/os_list.json'
+_CATALOG_MAX_AGE = 60*60
 
 def flatten(tree):
     result = []
@@ -19,24 +27,51 @@ def flatten(tree):
             result.append(i)
     return result
 
-def get_information():
+def get_information(max_age=_CATALOG_MAX_AGE):
+    """Get the flattened list of all image descriptions.
+
+    The os_list of the Raspberry Pi Imager is cached for max_age seconds.
+    """
+    cache = pathlib.Path(_CATALOG_CACHE).expanduser()
+    try:
+        if time.time() - cache.stat().st_mtime < max_age:
+            with open(cache) as f:
+                return flatten(json.load(f)['os_list'])
+    except (OSError, ValueError):
+        pass
+
     with urllib.request.urlopen(_IMAGINGUTILITY_URL) as f:
-        #text = f.read().decode('utf-8')
-        return flatten(json.load(f)['os_list'])
+        data = f.read()
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    cache.write_bytes(data)
+    return flatten(json.loads(data)['os_list'])
+
+_catalog = None
+_catalog_time = 0
 
+def get_catalog():
+    """Get the indexed catalog of all images.
+
+    The catalog is built once and rebuilt when the cached os_list expires
+    (relevant for the long running job daemon).
+    """
+    global _catalog, _catalog_time
+    if _catalog is None or time.time() - _catalog_time > _CATALOG_MAX_AGE:
+        _catalog = catalog.Catalog(get_information())
+        _catalog_time = time.time()
+    return _catalog
 
 def get_raspios_flavors():
     """Find all versions/flavors of the official Raspberry Pi OS.
 
     :return: list with the names"""
-    return [i['name'] for i in get_information()
-                        if 'Raspberry Pi OS' in i['name']]
+    return [i['name'] for i in get_catalog().search(name='Raspberry Pi OS')]
 
 def get_all_images():
     """Get all images the rpi-imager supports.
     
     :return: list with all the image names."""
-    return [i['name'] for i in get_information()]
+    return [i['name'] for i in get_catalog().entries]
 
 def get_image_description(name):
     if name == 'lite':
@@ -45,13 +80,124 @@ def get_image_description(name):
         name = 'Raspberry Pi OS (32-bit)'
     if name == 'full':
         name = 'Raspberry Pi OS Full (32-bit)'
-    return [x for x in get_information() if x['name'] == name][0]
+    return get_catalog().get(name)
 
 def get_filename(url):
     return pathlib.Path(url.split('/')[-1])
 
+def get_cache_paths(description, cache_folder):
+    """Get the paths of the archive and the extracted image in the cache.
+
+    :return: tuple with the path of the archive and the extracted image
+    """
+    filename = get_filename(description['url'])
+    extracted = filename.stem
+
+    cache_path = pathlib.Path(cache_folder).expanduser()
+    cache_path.mkdir(parents=True, exist_ok=True)
+
+    path_filename = cache_path.joinpath(filename)
+    path_extracted = cache_path.joinpath(extracted).with_suffix('.img')
+    return path_filename, path_extracted
+
+def is_extracted(path_extracted):
+    return path_extracted.exists() and not journal.pending(path_extracted)
+
+def open_image(description, cache_folder):
+    """Open a cached OS image for reading.
+
+    The extracted image is preferred. Otherwise the downloaded XZ archive is
+    opened as seekable view without extracting it.
+
+    :return: seekable binary file object
+    """
+    path_filename, path_extracted = get_cache_paths(description, cache_folder)
+
+    if is_extracted(path_extracted):
+        return open(path_extracted, 'rb')
+    if path_filename.suffix.lower() == '.xz' and path_filename.exists():
+        return xz_helper.XZFile(path_filename)
+    raise Exception(f'{description["name"]} is not in the cache')
+
+def get_partitions(name, cache_folder):
+    """Read the partition table of a cached OS image.
+
+    :return: list of mbr.Partition tuples
+    """
+    with open_image(get_image_description(name), cache_folder) as f:
+        return mbr.partitions(f)
+
+def download_image(description, cache_folder, keep=False, peers=()):
+    """Download the archive of an OS image unless it is already cached.
+
+    :param description: image description (see get_image_description)
+    :param cache_folder: path of a folder to keep the downloaded OS image
+    :param keep: publish the archive to peers
+    :param peers: base URLs of stations sharing their image cache
+    """
+    url = description['url']
+    download_sha256 = description.get('image_download_sha256')
+    path_filename, path_extracted = get_cache_paths(description, cache_folder)
+
+    if not is_extracted(path_extracted) and not path_filename.exists():
+        if not (download_sha256 and
+                peer_cache.fetch(peers, download_sha256, path_filename)):
+            helper.download(url, path_filename, download_sha256)
+
+    if keep and download_sha256 and path_filename.exists():
+        peer_cache.publish(path_filename, download_sha256,
+                           path_filename.parent)
+
+def extract_image(description, cache_folder):
+    """Extract the downloaded archive of an OS image."""
+    path_filename, path_extracted = get_cache_paths(description, cache_folder)
+
+    if not is_extracted(path_extracted):
+        helper.extract_all(path_filename, cache_folder)
+
+def discard_archive(description, cache_folder):
+    """Remove the downloaded archive (after the image has been checked).
+
+    The archive is no longer served to peers either.
+    """
+    path_filename, _ = get_cache_paths(description, cache_folder)
+    download_sha256 = description.get('image_download_sha256')
+
+    path_filename.unlink(True)
+    if download_sha256:
+        peer_cache.unpublish(download_sha256, path_filename.parent)
+
+def verify_image(description, cache_folder):
+    """Check the integrity of the extracted OS image."""
+    _, path_extracted = get_cache_paths(description, cache_folder)
+
+    if description['extract_sha256'] != helper.sha256(path_extracted):
+        raise Exception('Extracted file corrupted.')
+
+def write_image(description, cache_folder, output, become=False,
+    remove=False, tune=False):
+    """Write the extracted OS image to disk.
+
+    The write parameters stored for the device model are used.
+
+    :param remove: remove the extracted image after writing to disk
+    :param tune: benchmark the device first if its model is unknown
+    """
+    _, path_extracted = get_cache_paths(description, cache_folder)
+
+    udisks2.unmount(output)
+    if tune and not tuning.is_tuned(output):
+        tuning.tune(output, path_extracted.parent, become)
+    sudo.write(path_extracted, output, become, **tuning.parameters(output))
+
+    os.sync()
+
+    if remove:
+        path_extracted.unlink(True)
+
 def write(name, cache_folder, output, configuration=None, chksum=False,
-    become=False, remove=False, keep=False, encrypted=True):
+    become=False, remove=False, keep=False, encrypted=True, peers=(),
+    tune=False):
     """Write a OS image to disk.
 
     This method downloads the OS image given by name into the cache folder.
@@ -66,47 +212,29 @@ def write(name, cache_folder, output, configuration=None, chksum=False,
     :param remove: remove the extracted image after writing to disk
     :param keep: keep the downloaded compressed file
     :param encrypted: the provisioning configuration file is encrypted wit gpg
+    :param peers: base URLs of stations sharing their image cache
+    :param tune: benchmark the device first if its model is unknown
     """
     
     description = get_image_description(name)
 
-    url = description['url']
-    filename = get_filename(description['url'])
-    extracted = filename.stem
-    
-    cache_path = pathlib.Path(cache_folder).expanduser()
-    cache_path.mkdir(parents=True, exist_ok=True)
-
-    path_filename = cache_path.joinpath(filename)
-    path_extracted = cache_path.joinpath(extracted).with_suffix('.img')
-
-    if not path_extracted.exists() and not path_filename.exists():
-        helper.download(url, path_filename)
-
-    if not path_extracted.exists():
-        helper.extract_all(path_filename, cache_folder)
+    download_image(description, cache_folder, keep, peers)
+    extract_image(description, cache_folder)
 
     if chksum:      
-        if description['extract_sha256'] != helper.sha256(path_extracted):
-            raise Exception('Extracted file corrupted.')
+        verify_image(description, cache_folder)
 
     if not keep:
-        path_filename.unlink(True)
+        discard_archive(description, cache_folder)
 
     if output:
-        udisks2.unmount(output)
-        sudo.write(path_extracted, output, become)
-
-        os.sync()
-
-        if remove:
-            path_extracted.unlink(True)
+        write_image(description, cache_folder, output, become, remove, tune)
 
         if configuration:
             provision(configuration, output, encrypted)
 
 def provision(target, output, encrypted):
-    udisks2.mount(output)
+    snapshot = udisks2.mount(output)
 
     print(f'Provisioning {target} on {output}')
-    helper.customize_rpios(target, output, encrypted)
+    helper.customize_rpios(target, output, encrypted, snapshot)
@@ -0,0 +1,259 @@
+"""Queue and schedule write jobs of a flashing station.
+
+A daemon accepts jobs (image + device + provisioning configuration) on a
+local Unix socket. Every job runs through the stages download, extract,
+verify, write and provision. Each stage needs a resource (network, CPU,
+the USB host controller of the device or D-Bus) and every resource class
+has its own concurrency limit, so e.g. two cards behind the same
+controller are written one after the other while a card on another
+controller is written at the same time.
+
+The protocol is one JSON object per line in each direction.
+"""
+
+import itertools
+import json
+import os
+import pathlib
+import re
+import socket
+import socketserver
+import threading
+import traceback
+
+from . import imaging_utility as iu
+
+DEFAULT_SOCKET = '~/.cache/bake-a-py/daemon.sock'
+
+DEFAULT_LIMITS = dict(network=1, cpu=os.cpu_count() or 1, usb=1, dbus=1)
+
+# A job is queued until its first stage starts and waiting while a later
+# stage waits for its resource.
+QUEUED, WAITING, RUNNING, DONE, FAILED, CANCELLED = (
+    'queued', 'waiting', 'running', 'done', 'failed', 'cancelled')
+
+def usb_controller(device):
+    """Find the USB host controller a block device is attached to.
+
+    An xHCI controller has separate root hubs (usbN buses) for USB 2 and
+    USB 3, so the controller is identified by its own device (e.g. the PCI
+    address) above the root hub.
+
+    :param device: path of the device (e.g. /dev/sda)
+    :return: name of the resource for the controller (the device itself if
+        it is not attached via USB)
+    """
+    name = pathlib.Path(os.path.realpath(device)).name
+    sys_path = pathlib.Path('/sys/class/block', name).resolve()
+    for i, part in enumerate(sys_path.parts):
+        if re.fullmatch(r'usb\d+', part):
+            return f'usb:{sys_path.parts[i - 1]}'
+    return f'usb:{name}'
+
+class Cancelled(Exception):
+    pass
+
+class Job:
+
+    def __init__(self, id, os, output, target=None, chksum=False, keep=False,
+                 encrypted=True, peers=()):
+        self.id = id
+        self.os = os
+        self.output = output
+        self.target = target
+        self.chksum = chksum
+        self.keep = keep
+        self.encrypted = encrypted
+        self.peers = list(peers)
+        self.state = QUEUED
+        self.stage = None
+        self.error = None
+        self.cancel_requested = False
+
+    def status(self):
+        return dict(id=self.id, os=self.os, output=self.output,
+                    target=self.target, state=self.state, stage=self.stage,
+                    error=self.error)
+
+class Scheduler:
+    """Run jobs with per resource concurrency limits.
+
+    :param cache_folder: path of the image cache
+    :param limits: dictionary with the number of concurrent users of the
+        resource classes network, cpu, usb (per controller) and dbus
+    :param become: write as super user
+    """
+
+    def __init__(self, cache_folder, limits=None, become=False):
+        self.cache_folder = cache_folder
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.become = become
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._resources = {}
+        self._images = {}
+        self._outputs = {}
+
+    def _resource(self, name):
+        with self._lock:
+            if name not in self._resources:
+                limit = self.limits[name.split(':')[0]]
+                self._resources[name] = threading.BoundedSemaphore(limit)
+            return self._resources[name]
+
+    def _image_lock(self, name):
+        # Jobs for the same image share the download and the extraction.
+        with self._lock:
+            return self._images.setdefault(name, threading.Lock())
+
+    def _output_lock(self, output):
+        # A device is written and provisioned by one job at a time.
+        with self._lock:
+            return self._outputs.setdefault(os.path.realpath(output),
+                                            threading.Lock())
+
+    def submit(self, **kwargs):
+        """Queue a job.
+
+        :return: id of the job
+        """
+        with self._lock:
+            job = Job(next(self._ids), **kwargs)
+            self.jobs[job.id] = job
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return job.id
+
+    def _job(self, id):
+        with self._lock:
+            try:
+                return self.jobs[id]
+            except KeyError:
+                raise Exception(f'no job {id}')
+
+    def cancel(self, id):
+        """Cancel a job.
+
+        A running job stops before its next stage.
+        """
+        job = self._job(id)
+        with self._lock:
+            job.cancel_requested = True
+            if job.state in (QUEUED, WAITING):
+                job.state = CANCELLED
+            return job.status()
+
+    def status(self, id=None):
+        if id is not None:
+            return [self._job(id).status()]
+        with self._lock:
+            return [job.status() for job in self.jobs.values()]
+
+    def _wait(self, job, stage):
+        with self._lock:
+            if job.cancel_requested:
+                raise Cancelled()
+            job.stage = stage
+            if job.state != QUEUED:
+                job.state = WAITING
+
+    def _stage(self, job, stage, resource, func, *args):
+        self._wait(job, stage)
+        with self._resource(resource):
+            with self._lock:
+                if job.cancel_requested:
+                    raise Cancelled()
+                job.state = RUNNING
+            func(*args)
+
+    def _run(self, job):
+        try:
+            description = iu.get_image_description(job.os)
+            controller = usb_controller(job.output)
+            with self._image_lock(description['name']):
+                self._stage(job, 'download', 'network', iu.download_image,
+                    description, self.cache_folder, job.keep, job.peers)
+                self._stage(job, 'extract', 'cpu', iu.extract_image,
+                    description, self.cache_folder)
+            if job.chksum:
+                self._stage(job, 'verify', 'cpu', iu.verify_image,
+                    description, self.cache_folder)
+            if not job.keep:
+                iu.discard_archive(description, self.cache_folder)
+            self._wait(job, 'write')
+            with self._output_lock(job.output):
+                self._stage(job, 'write', controller, iu.write_image,
+                    description, self.cache_folder, job.output, self.become)
+                if job.target:
+                    self._stage(job, 'provision', 'dbus', iu.provision,
+                        job.target, job.output, job.encrypted)
+            with self._lock:
+                job.state = DONE
+        except Cancelled:
+            with self._lock:
+                job.state = CANCELLED
+        except Exception as exc:
+            traceback.print_exc()
+            with self._lock:
+                job.state = FAILED
+                job.error = str(exc)
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                command = request.pop('command')
+                if command == 'submit':
+                    result = dict(id=self.server.scheduler.submit(**request))
+                elif command == 'status':
+                    result = self.server.scheduler.status(**request)
+                elif command == 'cancel':
+                    result = self.server.scheduler.cancel(**request)
+                else:
+                    raise Exception(f'unknown command {command}')
+                response = dict(result=result)
+            except Exception as exc:
+                response = dict(error=str(exc))
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(cache_folder, socket_path=DEFAULT_SOCKET, limits=None,
+          become=False):
+    """Run the job daemon.
+
+    :param cache_folder: path of the image cache
+    :param socket_path: path of the Unix socket to listen on
+    :param limits: concurrency limits (see Scheduler)
+    :param become: write as super user
+    """
+    socket_path = pathlib.Path(socket_path).expanduser()
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    socket_path.unlink(True)
+    with _Server(str(socket_path), _RequestHandler) as server:
+        server.scheduler = Scheduler(cache_folder, limits, become)
+        print(f'waiting for jobs on {socket_path}')
+        try:
+            server.serve_forever()
+        finally:
+            socket_path.unlink(True)
+
+def request(command, socket_path=DEFAULT_SOCKET, **kwargs):
+    """Send a command to the job daemon.
+
+    :param command: one of submit, status and cancel
+    :return: result of the command
+    """
+    socket_path = pathlib.Path(socket_path).expanduser()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        with sock.makefile('rwb') as f:
+            f.write(json.dumps(dict(command=command, **kwargs)).encode('utf-8') + b'\n')
+            f.flush()
+            response = json.loads(f.readline())
+    if 'error' in response:
+        raise Exception(response['error'])
+    return response['result']
@@ -0,0 +1,169 @@
+"""Checkpoint long running writes so that they can be resumed.
+
+A journal is a file with one JSON object per line. The first line
+identifies the source of the data. Every further line records a completed
+(and synced) chunk with its end offset, length and digest. A rerun
+verifies the last recorded chunks (and the first and a middle one)
+against the destination and continues after the last one still matching.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+
+CHUNK_SIZE = 1024*1024
+
+# Number of recorded chunks checked before giving up and starting over.
+_VERIFY_LIMIT = 4
+
+def chunk_digest(chunk):
+    # blake2b is considerably faster than sha256 and good enough to detect
+    # stale or foreign data on the destination.
+    return hashlib.blake2b(chunk, digest_size=16).hexdigest()
+
+def path_for(dest):
+    """Get the journal path for a regular destination file."""
+    dest = pathlib.Path(dest)
+    return dest.with_name(dest.name + '.journal')
+
+def device_path(src, dest):
+    """Get the journal path for writing the image src to the device dest."""
+    src = pathlib.Path(src)
+    return src.with_name(f'{src.name}.{pathlib.Path(dest).name}.journal')
+
+def discard_device(folder, dest):
+    """Remove the journals of all images written to the device dest.
+
+    :param folder: folder containing the images (the image cache)
+    """
+    name = pathlib.Path(dest).name
+    for path in pathlib.Path(folder).expanduser().glob(f'*.{name}.journal'):
+        path.unlink(True)
+
+def pending(dest):
+    """Check if writing dest has been interrupted."""
+    return path_for(dest).exists()
+
+def identify(src, **kwargs):
+    """Describe the source file for the journal header."""
+    src = pathlib.Path(src).absolute()
+    stat = src.stat()
+    return dict(source=str(src), size=stat.st_size, mtime=stat.st_mtime_ns,
+                **kwargs)
+
+class Journal:
+    """Progress of copying a source to a destination.
+
+    :param path: path of the journal file
+    :param header: dictionary identifying the source (see identify)
+    """
+
+    def __init__(self, path, header):
+        self.path = pathlib.Path(path)
+        self.header = header
+        self._file = None
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as fin:
+                lines = fin.readlines()
+        except FileNotFoundError:
+            return []
+
+        entries = []
+        for n, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line may be incomplete after a power loss
+                break
+            if n == 0:
+                if entry != self.header:
+                    return []
+            else:
+                entries.append(entry)
+        return entries
+
+    def _verified(self, entries, dest):
+        try:
+            with open(dest, 'rb') as fin:
+                def matches(entry):
+                    fin.seek(entry['offset'] - entry['length'])
+                    return chunk_digest(fin.read(entry['length'])) == entry['digest']
+
+                for n in range(len(entries) - 1,
+                               max(len(entries) - 1 - _VERIFY_LIMIT, -1), -1):
+                    if matches(entries[n]):
+                        # A swapped card that was flashed with the same image
+                        # and booted may still match at the end, but differs
+                        # at the start (e.g. the resized partition table).
+                        if matches(entries[0]) and matches(entries[n // 2]):
+                            return entries[:n + 1]
+                        return []
+        except FileNotFoundError:
+            pass
+        return []
+
+    def resume(self, dest):
+        """Open the journal for recording.
+
+        :param dest: path of the destination
+        :return: offset up to which dest has been verified
+        """
+        entries = self._verified(self._load(), dest)
+
+        self._file = open(self.path, 'w')
+        for entry in [self.header] + entries:
+            print(json.dumps(entry), file=self._file)
+        self._file.flush()
+
+        return entries[-1]['offset'] if entries else 0
+
+    def record(self, offset, chunk, **kwargs):
+        """Record a chunk completely written to the destination.
+
+        :param offset: offset of the end of the chunk
+        :param chunk: the written data
+        """
+        entry = dict(offset=offset, length=len(chunk),
+                     digest=chunk_digest(chunk), **kwargs)
+        print(json.dumps(entry), file=self._file)
+        self._file.flush()
+
+    def complete(self):
+        """Remove the journal after the destination has been written."""
+        self.close()
+        self.path.unlink(True)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+def write_chunks(fin, fout, journal, offset=0, chunk_size=CHUNK_SIZE,
+                 sync_every=1, **kwargs):
+    """Copy fin to fout recording every synced chunk in the journal.
+
+    :param fin: source file object
+    :param fout: destination file object positioned at offset
+    :param journal: an opened Journal
+    :param offset: current position in the destination
+    :param chunk_size: number of bytes written at once
+    :param sync_every: number of chunks written between syncs
+    :return: position in the destination after copying
+    """
+    unsynced = []
+    chunk = fin.read(chunk_size)
+    while chunk:
+        fout.write(chunk)
+        offset += len(chunk)
+        unsynced.append((offset, chunk))
+        chunk = fin.read(chunk_size)
+        if len(unsynced) >= sync_every or not chunk:
+            fout.flush()
+            os.fsync(fout.fileno())
+            for end, data in unsynced:
+                journal.record(end, data, **kwargs)
+            unsynced = []
+    return offset
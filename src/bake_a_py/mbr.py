@@ -0,0 +1,74 @@
+"""Read the MBR partition table of an image.
+
+The image may be any seekable file object, e.g. a device, an extracted
+image or a xz_helper.XZFile.
+"""
+
+import collections
+
+SECTOR_SIZE = 512
+
+Partition = collections.namedtuple('Partition', [
+    'number', 'type', 'start', 'size', 'partuuid', 'label'])
+
+_FAT_TYPES = (0x01, 0x04, 0x06, 0x0b, 0x0c, 0x0e)
+_LINUX_TYPE = 0x83
+
+def _read(f, offset, size):
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) != size:
+        raise Exception(f'image too short (reading {size} bytes at {offset})')
+    return data
+
+def _fat_label(f, start):
+    boot_sector = _read(f, start, SECTOR_SIZE)
+    if boot_sector[0x42] == 0x29: # FAT32 extended boot signature
+        label = boot_sector[0x47:0x52]
+    elif boot_sector[0x26] == 0x29:
+        label = boot_sector[0x2b:0x36]
+    else:
+        return None
+    return label.decode('ascii', 'replace').strip()
+
+def _ext_label(f, start):
+    super_block = _read(f, start + 1024, 1024)
+    if super_block[0x38:0x3a] != bytes.fromhex('53ef'):
+        return None
+    return super_block[0x78:0x88].rstrip(b'\x00').decode('utf-8', 'replace')
+
+def partitions(f):
+    """Read the primary partitions.
+
+    :param f: seekable binary file object of the image
+    :return: list of Partition tuples (start and size in bytes)
+    """
+    mbr = _read(f, 0, SECTOR_SIZE)
+    if mbr[510:512] != bytes.fromhex('55aa'):
+        raise Exception('no MBR partition table')
+    disk_id = int.from_bytes(mbr[440:444], byteorder='little')
+
+    result = []
+    for number in range(1, 5):
+        entry = mbr[446 + (number - 1) * 16:446 + number * 16]
+        part_type = entry[4]
+        if part_type == 0:
+            continue
+        start = int.from_bytes(entry[8:12], byteorder='little') * SECTOR_SIZE
+        size = int.from_bytes(entry[12:16], byteorder='little') * SECTOR_SIZE
+        if part_type in _FAT_TYPES:
+            label = _fat_label(f, start)
+        elif part_type == _LINUX_TYPE:
+            label = _ext_label(f, start)
+        else:
+            label = None
+        result.append(Partition(number, part_type, start, size,
+                                f'{disk_id:08x}-{number:02x}', label))
+    return result
+
+def get_partuuid(f, label):
+    """Get the PARTUUID of the partition with the label."""
+    for partition in partitions(f):
+        if partition.label == label:
+            return partition.partuuid
+    return None
@@ -0,0 +1,132 @@
+"""Share the image cache with other stations on the LAN.
+
+Downloaded archives are published content-addressed under
+``<cache>/sha256/<hexdigest>``. A station serves this folder over HTTP and
+other stations ask their peers for a matching ``image_download_sha256``
+before downloading from upstream.
+"""
+
+import http.server
+import os
+import pathlib
+import re
+import shutil
+
+import requests
+
+from . import helper
+
+DEFAULT_PORT = 8787
+
+# Seconds to wait for connecting to a peer and for data from it. A peer
+# dropping off the LAN must not stall the write forever.
+FETCH_TIMEOUT = (5, 30)
+
+_SHA256_PATH = re.compile(r'^/sha256/([0-9a-f]{64})$')
+
+def _content_path(cache_folder, sha256):
+    return pathlib.Path(cache_folder).expanduser().joinpath('sha256', sha256)
+
+def publish(path, sha256, cache_folder):
+    """Make a file in the cache available to peers.
+
+    The file is hard linked (or copied if linking is not possible) into the
+    content-addressed part of the cache.
+
+    :param path: path of the file to publish
+    :param sha256: hex digest of the file
+    :param cache_folder: path of the image cache
+    """
+    dest = _content_path(cache_folder, sha256)
+    if dest.exists():
+        return
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(path, dest)
+    except OSError:
+        shutil.copyfile(path, dest)
+
+def unpublish(sha256, cache_folder):
+    """Remove a file from the content-addressed part of the cache."""
+    _content_path(cache_folder, sha256).unlink(True)
+
+def lookup(peers, sha256, timeout=2):
+    """Find a peer providing the content with the hash.
+
+    :param peers: list of peer base URLs (e.g. http://station2:8787)
+    :param sha256: hex digest of the requested content
+    :param timeout: seconds to wait for each peer
+    :return: URL of the content on the first peer having it or None
+    """
+    for peer in peers:
+        url = f'{peer.rstrip("/")}/sha256/{sha256}'
+        try:
+            response = requests.head(url, timeout=timeout)
+        except requests.RequestException:
+            continue
+        if response.status_code == 200:
+            return url
+    return None
+
+def fetch(peers, sha256, dest):
+    """Download the content with the hash from a peer.
+
+    The hash is verified while downloading. A peer delivering corrupted
+    content is skipped.
+
+    :param peers: list of peer base URLs
+    :param sha256: hex digest of the requested content
+    :param dest: path of the destination file
+    :return: True if the content was fetched from a peer
+    """
+    for peer in peers:
+        url = lookup([peer], sha256)
+        if url is None:
+            continue
+        try:
+            helper.download(url, dest, sha256, FETCH_TIMEOUT)
+            return True
+        except Exception as exc:
+            helper.eprint(f'fetching from peer {url} failed ({exc})')
+    return False
+
+class _CacheRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    cache_folder = None
+
+    def _send_headers(self):
+        match = _SHA256_PATH.match(self.path)
+        if not match:
+            self.send_error(404)
+            return None
+        path = _content_path(self.cache_folder, match.group(1))
+        if not path.is_file():
+            self.send_error(404)
+            return None
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(path.stat().st_size))
+        self.end_headers()
+        return path
+
+    def do_HEAD(self):
+        self._send_headers()
+
+    def do_GET(self):
+        path = self._send_headers()
+        if path:
+            with open(path, 'rb') as fin:
+                shutil.copyfileobj(fin, self.wfile, 1024*1024)
+
+def serve(cache_folder, port=DEFAULT_PORT, bind=''):
+    """Serve the content-addressed image cache over HTTP.
+
+    :param cache_folder: path of the image cache
+    :param port: TCP port to listen on
+    :param bind: address to bind to (default all interfaces)
+    """
+    handler = type('CacheRequestHandler', (_CacheRequestHandler,),
+                   dict(cache_folder=cache_folder))
+    with http.server.ThreadingHTTPServer((bind, port), handler) as server:
+        print(f'serving {pathlib.Path(cache_folder).expanduser()} on port {port}')
+        server.serve_forever()
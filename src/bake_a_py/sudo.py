@@ -5,8 +5,10 @@ This module contains some trickery enabling a restart with sudo.
 
 import os
 import pathlib
+import json
 import subprocess
 import sys
+import time
 
 # The super user has a different environment. The following code adds the
 # calling user's local site packages path. This is necessary if the package
@@ -19,25 +21,96 @@ if not module_path in sys.path:
 # The following must be imported after the corrected sys.path
 from tqdm.auto import tqdm
 
-def write(src, dest, become=False):
+from bake_a_py import journal
+from bake_a_py import sysfs
+
+# Sizes and sync intervals tried by bench. Every probe starts at offset 0,
+# which is aligned to the erase blocks of the device.
+BENCH_CHUNK_SIZES = (1024*1024, 4*1024*1024, 8*1024*1024)
+BENCH_SYNC_INTERVALS = (1, 4, 8)
+# Every probe syncs at least once per interval even for the largest chunks.
+BENCH_SIZE = max(BENCH_CHUNK_SIZES) * max(BENCH_SYNC_INTERVALS)
+
+def write(src, dest, become=False, chunk_size=journal.CHUNK_SIZE,
+          sync_every=1):
+    """Write the image src to the device dest.
+
+    Every written chunk is recorded in a journal next to the image. An
+    interrupted write continues after the last chunk verified on the
+    device.
+
+    :param chunk_size: number of bytes written at once
+    :param sync_every: number of chunks written between syncs
+    """
     if become:
-        subprocess.run(['sudo', sys.executable, __file__, 
-            pathlib.Path(src).absolute(), pathlib.Path(dest).absolute()])
+        result = subprocess.run(['sudo', sys.executable, __file__, 
+            pathlib.Path(src).absolute(), pathlib.Path(dest).absolute(),
+            str(chunk_size), str(sync_every)])
+        if result.returncode != 0:
+            raise Exception(f'writing {src} to {dest} interrupted or failed')
     else:
-        with open(src, 'rb') as fin, tqdm.wrapattr(open(dest, 'wb'), 'write',
-            unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
-            desc="Writing image", total=pathlib.Path(src).stat().st_size
-            ) as fout:
-            chunk = fin.read(1024*1024)
-            while chunk:
-                fout.write(chunk)
-                fout.flush()
-                os.fsync(fout.fileno())
-                chunk = fin.read(1024*1024)
-        os.sync()
+        src = pathlib.Path(src)
+        size = src.stat().st_size
+        jrnl = journal.Journal(journal.device_path(src, dest),
+            journal.identify(src, dest=str(dest),
+                             medium=sysfs.medium_id(dest)))
+        offset = jrnl.resume(dest)
+        try:
+            with open(src, 'rb') as fin, tqdm.wrapattr(
+                open(dest, 'r+b' if offset else 'wb'), 'write',
+                unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
+                desc="Writing image", total=size, initial=offset
+                ) as fout:
+                fin.seek(offset)
+                fout.seek(offset)
+                journal.write_chunks(fin, fout, jrnl, offset, chunk_size,
+                                     sync_every)
+            os.sync()
+        finally:
+            jrnl.close()
+        jrnl.complete()
+
+def bench(dest, become=False):
+    """Measure the sequential write throughput of the device dest.
+
+    The first BENCH_SIZE bytes of the device are overwritten.
+
+    :return: list of dictionaries with chunk_size, sync_every and throughput
+        (bytes per second)
+    """
+    if become:
+        result = subprocess.run(['sudo', sys.executable, __file__, '--bench',
+            pathlib.Path(dest).absolute()], stdout=subprocess.PIPE)
+        if result.returncode != 0:
+            raise Exception(f'benchmarking {dest} failed')
+        return json.loads(result.stdout)
+
+    data = os.urandom(max(BENCH_CHUNK_SIZES))
+    with open(dest, 'r+b', buffering=0) as fout:
+        # The first pass only wakes up the device and is not measured.
+        _bench_pass(fout, data, BENCH_CHUNK_SIZES[0], BENCH_SYNC_INTERVALS[0])
+        return [dict(chunk_size=chunk_size, sync_every=sync_every,
+                     throughput=_bench_pass(fout, data, chunk_size, sync_every))
+                for chunk_size in BENCH_CHUNK_SIZES
+                for sync_every in BENCH_SYNC_INTERVALS]
+
+def _bench_pass(fout, data, chunk_size, sync_every):
+    fout.seek(0)
+    start = time.monotonic()
+    for n in range(1, BENCH_SIZE // chunk_size + 1):
+        fout.write(data[:chunk_size])
+        if n % sync_every == 0:
+            os.fsync(fout.fileno())
+    os.fsync(fout.fileno())
+    return BENCH_SIZE / (time.monotonic() - start)
 
 if __name__ == '__main__':
+    if sys.argv[1] == '--bench':
+        print(json.dumps(bench(sys.argv[2])))
+        sys.exit()
     try:
-        write(sys.argv[1], sys.argv[2])
+        write(sys.argv[1], sys.argv[2], chunk_size=int(sys.argv[3]),
+              sync_every=int(sys.argv[4]))
     except KeyboardInterrupt:
-        pass
+        print('Writing interrupted, rerun to resume.', file=sys.stderr)
+        sys.exit(130)
@@ -0,0 +1,47 @@
+"""Identify block devices with the attributes in sysfs."""
+
+import os
+import pathlib
+
+def _read_attribute(path):
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return ''
+
+def device_id(device):
+    """Identify a device by vendor, model and serial number from sysfs.
+
+    :param device: path of the device (e.g. /dev/sda)
+    :return: identification string
+    """
+    name = pathlib.Path(os.path.realpath(device)).name
+    sys_path = pathlib.Path('/sys/class/block', name, 'device').resolve()
+
+    vendor = _read_attribute(sys_path / 'vendor')
+    model = _read_attribute(sys_path / 'model') or _read_attribute(sys_path / 'name')
+    serial = _read_attribute(sys_path / 'serial')
+    # USB drives have the serial number in the USB device
+    for parent in sys_path.parents:
+        if serial:
+            break
+        serial = _read_attribute(parent / 'serial')
+
+    return ' '.join(s for s in (vendor, model, serial) if s) or name
+
+def medium_id(device):
+    """Identify the medium in a device as closely as sysfs allows.
+
+    Besides vendor, model and serial number (which for a card reader may
+    describe the reader), the card identification of SD cards and the
+    capacity are used.
+
+    :param device: path of the device (e.g. /dev/sda)
+    :return: identification string
+    """
+    name = pathlib.Path(os.path.realpath(device)).name
+    sys_path = pathlib.Path('/sys/class/block', name)
+
+    cid = _read_attribute(sys_path / 'device' / 'cid')
+    size = _read_attribute(sys_path / 'size')
+    return ' '.join(s for s in (device_id(device), cid, size) if s)
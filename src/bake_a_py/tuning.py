@@ -0,0 +1,59 @@
+"""Choose write parameters per device model.
+
+The write throughput of SD cards and USB drives depends heavily on the
+size of the written chunks (erase block size) and on how often the
+written data is synced. The best parameters found by benchmarking a
+device are stored per model and serial number and used for later writes.
+"""
+
+import json
+import pathlib
+
+from . import journal
+from . import sudo
+from .sysfs import device_id
+
+DEFAULT_CACHE = '~/.cache/bake-a-py/devices.json'
+
+DEFAULT_PARAMETERS = dict(chunk_size=1024*1024, sync_every=1)
+
+def _load(cache):
+    try:
+        with open(pathlib.Path(cache).expanduser()) as fin:
+            return json.load(fin)
+    except FileNotFoundError:
+        return {}
+
+def parameters(device, cache=DEFAULT_CACHE):
+    """Get the write parameters for a device.
+
+    :return: dictionary with chunk_size and sync_every (see sudo.write)
+    """
+    return _load(cache).get(device_id(device), DEFAULT_PARAMETERS)
+
+def is_tuned(device, cache=DEFAULT_CACHE):
+    return device_id(device) in _load(cache)
+
+def tune(device, image_cache, become=False, cache=DEFAULT_CACHE):
+    """Benchmark a device and store the best write parameters.
+
+    The start of the device is overwritten, so interrupted writes to the
+    device can not be resumed and their journals are removed.
+
+    :param image_cache: path of the image cache holding the write journals
+
+    :return: list of the benchmark results
+    """
+    journal.discard_device(image_cache, device)
+    results = sudo.bench(device, become)
+    best = max(results, key=lambda r: r['throughput'])
+
+    devices = _load(cache)
+    devices[device_id(device)] = dict(chunk_size=best['chunk_size'],
+                                      sync_every=best['sync_every'])
+    path = pathlib.Path(cache).expanduser()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as fout:
+        json.dump(devices, fout, indent=2)
+
+    return results
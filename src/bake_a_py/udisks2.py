@@ -1,5 +1,6 @@
 """Accessing UDisk2 with D-Bus."""
 
+import concurrent.futures
 import time
 import dbus
 
@@ -13,6 +14,66 @@ def resolve_devices(path):
     result = obj.ResolveDevice(dict(path=path), [], dbus_interface="org.freedesktop.UDisks2.Manager")
     return result
 
+class Snapshot:
+    """Properties of a device and its partitions.
+
+    All properties of the Block, Partition, PartitionTable and Filesystem
+    interfaces are fetched with a single GetManagedObjects call instead of
+    one Properties.Get call per property and partition.
+
+    :param path: path of the device (e.g. /dev/sda)
+    """
+
+    def __init__(self, path):
+        self.device = str(resolve_devices(path)[0])
+        self.mounted = {}
+        self.refresh()
+
+    def refresh(self):
+        """Fetch the properties again (e.g. after the device was re-probed)."""
+        obj = system_bus.get_object('org.freedesktop.UDisks2', '/org/freedesktop/UDisks2')
+        objects = obj.GetManagedObjects(dbus_interface='org.freedesktop.DBus.ObjectManager',
+            byte_arrays=True)
+
+        table = objects.get(self.device, {}).get('org.freedesktop.UDisks2.PartitionTable', {})
+        self.partitions = [str(part) for part in table.get('Partitions', [])]
+        self.properties = {str(path): interfaces for path, interfaces in objects.items()
+            if str(path) in [self.device] + self.partitions}
+
+    def get(self, device, interface, name, default=None):
+        interfaces = self.properties.get(device, {})
+        return interfaces.get(f'org.freedesktop.UDisks2.{interface}', {}).get(name, default)
+
+    def label(self, device):
+        return self.get(device, 'Block', 'IdLabel')
+
+    def partuuid(self, device):
+        return self.get(device, 'Partition', 'UUID')
+
+    def mountpoint(self, device):
+        if device in self.mounted:
+            return self.mounted[device]
+        mount_points = self.get(device, 'Filesystem', 'MountPoints', [])
+        if not mount_points:
+            return None
+        return bytes(mount_points[0]).rstrip(b'\x00').decode('UTF-8')
+
+    def find(self, label):
+        """Find the partition with the label."""
+        for part in self.partitions:
+            if self.label(part) == label:
+                return part
+        return None
+
+    def targets(self):
+        """Get the partitions to (un)mount (or the device itself)."""
+        return self.partitions or [self.device]
+
+def _for_each(func, devices):
+    # The D-Bus calls block, run them for all partitions at the same time.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(devices)) as executor:
+        return list(executor.map(func, devices))
+
 def _unmount(device):
     obj = system_bus.get_object('org.freedesktop.UDisks2', device)
     try:
@@ -21,18 +82,16 @@ def _unmount(device):
         if exc.get_dbus_name() != 'org.freedesktop.UDisks2.Error.NotMounted':
             raise exc
 
-def unmount(path):
+def unmount(path, snapshot=None):
     """Unmount the device given by path.
 
-    :return: ."""
-    device = resolve_devices(path)[0]
+    :param snapshot: Snapshot of the device (taken if not given)
+    :return: the snapshot."""
+    snapshot = snapshot or Snapshot(path)
 
-    partitions = _get_partitions(device)
-    if partitions:
-        for part in partitions:
-            _unmount(part)
-    else:
-        _unmount(device)
+    _for_each(_unmount, snapshot.targets())
+    snapshot.mounted = {}
+    return snapshot
 
 def _mount(device):
     
@@ -48,8 +107,7 @@ def _mount(device):
         counter -= 1
         try:
             obj = system_bus.get_object('org.freedesktop.UDisks2', device)
-            iface = dbus.Interface(obj, 'org.freedesktop.UDisks2.Filesystem')
-            obj.Mount(dict(), dbus_interface="org.freedesktop.UDisks2.Filesystem")
+            return str(obj.Mount(dict(), dbus_interface="org.freedesktop.UDisks2.Filesystem"))
         except dbus.exceptions.DBusException as exc:
             if exc.get_dbus_name() != 'org.freedesktop.UDisks2.Error.AlreadyMounted':
                 raise exc
@@ -58,62 +116,41 @@ def _mount(device):
             # Linux needs some time after writing the image to get the system ready 
             # for mounting. D-Bus reacts with a ValueError. We wait a second and try again.
             pass
+    return None
 
 def mount(path):
     """Mount the device given by path.
     
-    :return: mounted path."""
-    device = resolve_devices(path)[0]
-
-    partitions = _get_partitions(device)
-    if partitions:
-        for part in partitions:
-            _mount(part)
-    else:
-        _mount(device)
-
-def _get_uuid(device):
-    obj = system_bus.get_object('org.freedesktop.UDisks2', device)
-    iface = dbus.Interface(obj, 'org.freedesktop.DBus.Properties')
-    result = iface.Get('org.freedesktop.UDisks2.Partition', 'UUID')
-
-    return result
-
-def get_partuuid(path, label):
-    device = resolve_devices(path)[0]
-
-    for dev in _get_partitions(device):
-        if _get_label(dev) == label:
-            return _get_uuid(dev)
+    :return: Snapshot of the device knowing the mounted paths."""
+    snapshot = Snapshot(path)
 
-    return None
+    targets = snapshot.targets()
+    mountpoints = _for_each(_mount, targets)
 
-def _get_partitions(device):
-    obj = system_bus.get_object('org.freedesktop.UDisks2', device)
-    iface = dbus.Interface(obj, 'org.freedesktop.DBus.Properties')
-    result = iface.Get('org.freedesktop.UDisks2.PartitionTable', 'Partitions')
+    # udisks re-probes a freshly written device until it is mountable, so
+    # labels and UUIDs read before mounting may still be the old ones.
+    snapshot.refresh()
+    for device, mountpoint in zip(targets, mountpoints):
+        if mountpoint:
+            snapshot.mounted[device] = mountpoint
+    return snapshot
 
-    return result
+def get_partuuid(path, label, snapshot=None):
+    """Get the PARTUUID of the partition with the label.
 
-def _get_label(device):
-    obj = system_bus.get_object('org.freedesktop.UDisks2', device)
-    iface = dbus.Interface(obj, 'org.freedesktop.DBus.Properties')
-    result = iface.Get('org.freedesktop.UDisks2.Block', 'IdLabel')
+    :param snapshot: Snapshot of the device (taken if not given)
+    """
+    snapshot = snapshot or Snapshot(path)
 
-    return result
+    part = snapshot.find(label)
+    return snapshot.partuuid(part) if part else None
 
-def _get_mountpoint(device):
-    obj = system_bus.get_object('org.freedesktop.UDisks2', device)
-    iface = dbus.Interface(obj, 'org.freedesktop.DBus.Properties')
-    result = iface.Get('org.freedesktop.UDisks2.Filesystem', 'MountPoints', byte_arrays=True)
-
-    return result[0][:-1].decode('UTF-8')
+def find_boot(path, snapshot=None):
+    """Get the mount point of the boot partition.
 
-def find_boot(path):
-    device = resolve_devices(path)[0]
+    :param snapshot: Snapshot of the device (taken if not given)
+    """
+    snapshot = snapshot or Snapshot(path)
 
-    for dev in _get_partitions(device):
-        if _get_label(dev) == 'boot':
-            return _get_mountpoint(dev)
-
-    return None
+    part = snapshot.find('boot')
+    return snapshot.mountpoint(part) if part else None
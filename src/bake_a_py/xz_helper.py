@@ -4,6 +4,17 @@ The code is based on the "specification" https://tukaani.org/xz/xz-file-format.t
 
 """
 
+import bisect
+import collections
+import io
+import lzma
+import os
+import zlib
+
+Block = collections.namedtuple('Block', [
+    'index', 'compressed_offset', 'padded_size', 'unpadded_size',
+    'uncompressed_offset', 'uncompressed_size'])
+
 check_sum_algorithms = (
     # bytes, name
     (0, 'None'),
@@ -181,6 +192,189 @@ def read_index(f, verbose):
 
     return result
 
+def xz_blocks(filename):
+    """Read the block index of a XZ file.
+
+    Only files containing a single stream (without stream padding) are
+    supported. Files compressed by xz with multiple threads (or with
+    --block-size) contain many blocks, each of which can be decompressed on
+    its own.
+
+    :param filename: path of the XZ file
+    :return: stream header and list of Block tuples
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(12)
+        if header[:6] != bytes.fromhex('fd377a585a00'):
+            raise Exception(f'{filename} has not XZ magic')
+
+        file_size = f.seek(0, os.SEEK_END)
+        f.seek(-12, os.SEEK_END)
+        footer = f.read(12)
+        if footer[10:] != bytes.fromhex('595a'):
+            raise Exception(f'{filename} has not XZ footer magic')
+        if footer[8:10] != header[6:8]:
+            raise Exception(f'{filename} contains multiple streams')
+
+        index_size = (int.from_bytes(footer[4:8], byteorder='little') + 1) * 4
+        index_offset = file_size - 12 - index_size
+        f.seek(index_offset)
+        if f.read(1) != b'\x00':
+            raise Exception(f'{filename} has no index')
+        records = read_index(f, False)
+
+    blocks = []
+    compressed_offset, uncompressed_offset = 12, 0
+    for block_number, unpadded_size, uncompressed_size in records:
+        padded_size = ((unpadded_size + 3) // 4) * 4
+        blocks.append(Block(block_number, compressed_offset, padded_size,
+            unpadded_size, uncompressed_offset, uncompressed_size))
+        compressed_offset += padded_size
+        uncompressed_offset += uncompressed_size
+
+    if compressed_offset != index_offset:
+        raise Exception(f'{filename} contains multiple streams')
+
+    return header, blocks
+
+class _BlockStream(io.RawIOBase):
+    """A single block of a XZ file wrapped into a stream of its own."""
+
+    def __init__(self, f, header, block):
+        index = bytearray(b'\x00')
+        index += multibyte_encode(1)
+        index += multibyte_encode(block.unpadded_size)
+        index += multibyte_encode(block.uncompressed_size)
+        index += bytes(-len(index) % 4)
+        index += zlib.crc32(index).to_bytes(4, byteorder='little')
+
+        footer = (len(index) // 4 - 1).to_bytes(4, byteorder='little') + header[6:8]
+        footer = zlib.crc32(footer).to_bytes(4, byteorder='little') + footer + b'YZ'
+
+        self._parts = [
+            io.BytesIO(header),
+            _Slice(f, block.compressed_offset, block.padded_size),
+            io.BytesIO(bytes(index) + footer)]
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._parts:
+            n = self._parts[0].readinto(b)
+            if n:
+                return n
+            self._parts.pop(0)
+        return 0
+
+class _Slice(io.RawIOBase):
+
+    def __init__(self, f, offset, size):
+        self._f = f
+        self._offset = offset
+        self._remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._remaining)
+        if not n:
+            return 0
+        self._f.seek(self._offset)
+        data = self._f.read(n)
+        b[:len(data)] = data
+        self._offset += len(data)
+        self._remaining -= len(data)
+        return len(data)
+
+def open_block(f, header, block):
+    """Open a single block of a XZ file for decompression.
+
+    :param f: XZ file opened in binary mode
+    :param header: stream header as returned by xz_blocks
+    :param block: Block tuple as returned by xz_blocks
+    :return: file object with the decompressed data of the block
+    """
+    return lzma.LZMAFile(io.BufferedReader(_BlockStream(f, header, block)))
+
+class XZFile(io.RawIOBase):
+    """Seekable read-only view of the decompressed data of a XZ file.
+
+    Only the blocks covering a requested range are decompressed. The most
+    recently used decompressed blocks are kept in memory. A block is only
+    decompressed up to the end of the requested range, so the start of a
+    file consisting of a single block is available quickly as well.
+
+    :param filename: path of the XZ file
+    :param cache_size: number of decompressed blocks kept in memory
+    """
+
+    def __init__(self, filename, cache_size=4):
+        self._header, self._blocks = xz_blocks(filename)
+        self._starts = [b.uncompressed_offset for b in self._blocks]
+        self._size = sum(b.uncompressed_size for b in self._blocks)
+        self._file = open(filename, 'rb')
+        self._cache = collections.OrderedDict()
+        self._cache_size = cache_size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError(f'negative seek position {offset}')
+        self._pos = offset
+        return self._pos
+
+    def _decompressed(self, block, size):
+        data = self._cache.pop(block.index, b'')
+        if len(data) < size:
+            with open_block(self._file, self._header, block) as fin:
+                data = fin.read(size)
+        self._cache[block.index] = data
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return data
+
+    def readinto(self, b):
+        # Reads spanning several blocks are served completely.
+        n = 0
+        while n < len(b) and self._pos < self._size:
+            block = self._blocks[bisect.bisect_right(self._starts, self._pos) - 1]
+            start = self._pos - block.uncompressed_offset
+            end = min(start + len(b) - n, block.uncompressed_size)
+            data = self._decompressed(block, end)[start:end]
+            b[n:n + len(data)] = data
+            n += len(data)
+            self._pos += len(data)
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+            self._cache.clear()
+        super().close()
+
+def multibyte_encode(value):
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
 def multibyte_decode(f):
 
     b = f.read(1)[0]